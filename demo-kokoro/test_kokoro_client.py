@@ -5,6 +5,8 @@ import os
 import time
 
 def read_json_rpc(stdout):
+    # MCP stdio frames messages as newline-delimited JSON (no Content-Length
+    # headers), so one buffered readline returns exactly one message
     line = stdout.readline()
     if not line:
         return None
@@ -31,7 +33,7 @@ def main():
         stdout=subprocess.PIPE,
         stderr=sys.stderr,
         text=True,
-        bufsize=0
+        bufsize=-1
     )
 
     try:
@@ -9,10 +9,21 @@ PATENT PENDING
 
 import time
 import os
+import contextlib
+import importlib.metadata
 import shutil
-import subprocess
-import soundfile as sf
+
+# Let the CUDA caching allocator grow segments in place instead of fragmenting
+# (PyTorch 2.1+). It is read once when CUDA initializes, so it has to be set
+# before torch is imported; an explicit PYTORCH_CUDA_ALLOC_CONF always wins.
+try:
+    if tuple(int(p) for p in importlib.metadata.version('torch').split('.')[:2]) >= (2, 1):
+        os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', 'expandable_segments:True')
+except (importlib.metadata.PackageNotFoundError, ValueError):
+    pass
+
 import numpy as np
+import lameenc
 import torch
 from kokoro import KPipeline
 from watchdog.observers import Observer
@@ -22,7 +33,9 @@ import queue
 import re
 import sys
 import json
+import collections
 import socket
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration
 DATA_DIR = "/app/data"
@@ -31,8 +44,28 @@ WORKING_DIR = os.path.join(DATA_DIR, "working")
 DONE_DIR = os.path.join(DATA_DIR, "done")
 MP3_DIR = os.path.join(DATA_DIR, "mp3")
 POLL_INTERVAL = 0.1
+# Idle rescan of TODO, covering files the watcher never reported
+TODO_RESCAN_INTERVAL = 1.0
+# Coalesce encoded PCM into ~64 KiB socket writes, flushing early when the
+# audio queue goes idle so short utterances are not held back.
+WRITE_BATCH_BYTES = 65536
+WRITE_FLUSH_TIMEOUT = 0.02
+# Bound on audio_queue so a stalled audio proxy applies backpressure to the
+# generator instead of letting it buffer a whole script in RAM. Each item is
+# one Kokoro sentence (a few seconds of 24 kHz audio), so 8 chunks keeps the
+# player well ahead; the cost is some generator idle time.
+AUDIO_QUEUE_MAX_CHUNKS = 8
+# Tasks remembered for the 'previous' control command
+COMPLETED_TASKS_MAX = 100
+# Sentences phonemized ahead of the one being synthesized, so G2P (spaCy plus
+# the espeak fallback) runs while the model is busy instead of between calls
+G2P_PREFETCH = 4
 DEFAULT_VOICE = os.getenv('KOKORO_VOICE', 'af_heart')
 LANG_CODE = 'a'
+# Inference precision on CUDA: fp32 (default), fp16, bf16, or auto (bf16 where supported, else fp16)
+PRECISION = os.getenv('KOKORO_PRECISION', 'fp32').lower()
+# Compile the model forward with torch.compile (PyTorch 2.x); compilation happens during warm-up
+TORCH_COMPILE = os.getenv('TORCH_COMPILE', 'false').lower() == 'true'
 
 # Valid Voices
 VALID_VOICES = {
@@ -41,16 +74,62 @@ VALID_VOICES = {
     'bf_emma', 'bf_isabella', 'bm_george', 'bm_lewis'
 }
 
+# Inline command tags, e.g. {voice:af_bella}, and the sentence splitter
+SEGMENT_SPLIT_RE = re.compile(r'(\{[a-zA-Z]+:[^}]+\})')
+SEGMENT_COMMAND_RE = re.compile(r'\{([a-zA-Z]+):([^}]+)\}')
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[\.\?\!])\s+|\n+')
+
 # Global Pipeline
 pipeline = None
+inference_device = 'cpu'
+inference_dtype = None  # autocast dtype, None for fp32
+# Single worker: G2P stays serialized, it just runs off the generator thread
+g2p_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='g2p')
+
+class ChunkQueue:
+    """Bounded deque + Condition FIFO for audio chunks; raises queue.Empty like queue.Queue."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            while len(self._items) >= self.maxsize:
+                self._cond.wait()
+            self._items.append(item)
+            if len(self._items) == 1:
+                self._cond.notify_all()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            return self._pop()
+
+    def get_nowait(self):
+        with self._cond:
+            if not self._items:
+                raise queue.Empty
+            return self._pop()
+
+    def empty(self):
+        return not self._items
+
+    def _pop(self):
+        item = self._items.popleft()
+        if len(self._items) == self.maxsize - 1:
+            self._cond.notify_all()
+        return item
 
 # Queues
 # task_queue holds either file paths (str) or dicts (memory tasks)
 task_queue = queue.Queue()
-audio_queue = queue.Queue()
-
-# Event to wake up the file watcher
-fs_event = threading.Event()
+# fs_queue holds (mtime, path) for TODO files reported by the watcher, consumed
+# oldest-first by the orchestrator in main()
+fs_queue = queue.PriorityQueue()
+audio_queue = ChunkQueue(AUDIO_QUEUE_MAX_CHUNKS)
 
 # Playback control state
 playback_state = {
@@ -63,25 +142,121 @@ pause_event = threading.Event()
 pause_event.set()  # Start unpaused
 
 # Completed task history for previous/next navigation
-completed_tasks = []
+completed_tasks = collections.deque(maxlen=COMPLETED_TASKS_MAX)
 current_task_index = -1
 
+# Cancel tokens for file tasks, keyed by WORKING path
+cancel_tokens = {}
+
+class CancelToken:
+    """Set when a file task's source leaves WORKING."""
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self._event = threading.Event()
+        self._next_check = time.monotonic() + self.CHECK_INTERVAL
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        if self._event.is_set():
+            return True
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.CHECK_INTERVAL
+            if not os.path.exists(self.path):
+                self._event.set()
+        return self._event.is_set()
+
+def get_cancel_token(path):
+    token = cancel_tokens.get(path)
+    if token is None:
+        token = cancel_tokens[path] = CancelToken(path)
+    return token
+
 class AudioChunk:
-    def __init__(self, audio_data, sample_rate, volume, source_id, is_end_of_file=False, mp3_info=None):
+    __slots__ = ('audio_data', 'sample_rate', 'volume', 'source_id', 'is_end_of_file', 'mp3_info', 'cancel')
+
+    def __init__(self, audio_data, sample_rate, volume, source_id, is_end_of_file=False, mp3_info=None, cancel=None):
         self.audio_data = audio_data
         self.sample_rate = sample_rate
         self.volume = volume
         self.source_id = source_id
         self.is_end_of_file = is_end_of_file
-        self.mp3_info = mp3_info  # Dict with mp3_path and accumulated audio
+        self.mp3_info = mp3_info  # Dict with mp3 path and its streaming MP3Encoder
+        self.cancel = cancel  # CancelToken for file tasks
+
+def design_halfband_odd_taps(half_len, beta=8.6):
+    """Odd phase of a Kaiser-windowed sinc half-band interpolator, normalized to unit DC gain."""
+    offsets = np.arange(-2 * half_len + 1, 2 * half_len, 2)
+    window = np.kaiser(4 * half_len - 1, beta)[offsets + 2 * half_len - 1]
+    taps = np.sinc(offsets / 2) * window
+    return (taps / taps.sum()).astype(np.float32)
+
+# 2x interpolation filter for the 24 kHz -> 48 kHz player path (32-tap equivalent)
+HALFBAND_HALF_LEN = 8
+HALFBAND_ODD_TAPS = design_halfband_odd_taps(HALFBAND_HALF_LEN)
+
+def grow_buffer(buf, n):
+    """Return buf if it holds n items, else a larger empty buffer (at least doubled)."""
+    if buf.size >= n:
+        return buf
+    return np.empty(max(n, 2 * buf.size), dtype=buf.dtype)
+
+class MP3Encoder:
+    """Encodes float32 PCM to MP3 in-process with libmp3lame as it is generated."""
+    BIT_RATE = 96  # kbps; 24 kHz mono speech (MPEG-2 Layer III tops out at 160)
+
+    def __init__(self, path, sample_rate=24000):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.encoder = lameenc.Encoder()
+        self.encoder.set_bit_rate(self.BIT_RATE)
+        self.encoder.set_in_sample_rate(sample_rate)
+        self.encoder.set_channels(1)
+        self.encoder.set_quality(2)
+        self.file = open(path, 'wb')
+
+    def write(self, audio):
+        pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2')
+        self.file.write(self.encoder.encode(pcm.tobytes()))
+
+    def close(self):
+        """Flush the encoder and finish the file."""
+        try:
+            self.file.write(self.encoder.flush())
+        finally:
+            self.file.close()
+
+    def abort(self):
+        """Stop encoding and remove the partial output."""
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
 
 class TCPPlayer:
+    CONNECT_TIMEOUT = 2.0
+    MAX_RETRY_DELAY = 2.0
+    # Kernel send buffer: room for a few batched writes (~2.7 s at 48 kHz Int16)
+    # without queueing so much audio that stop/skip lag behind
+    SEND_BUFFER_BYTES = 256 * 1024
+
     def __init__(self, host="host.docker.internal", port=3007, sample_rate=24000, target_rate=48000):
         self.host = host
         self.port = port
         self.sample_rate = sample_rate
         self.target_rate = target_rate
         self.socket = None
+        self._retry_delay = 0.1
+        # Scratch buffers, grown on demand and reused per chunk
+        self._up = np.empty(0, dtype=np.float32)
+        self._i16 = np.empty(0, dtype=np.int16)
+        # Encoded PCM waiting to be sent as one larger write
+        self._pending = bytearray()
 
     def connect_socket(self):
         if self.socket:
@@ -93,8 +268,15 @@ class TCPPlayer:
 
         try:
             print(f"TCPPlayer: Connecting to {self.host}:{self.port}...")
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
+            # Bound the connect so an unreachable proxy cannot hang the player,
+            # then clear the timeout so sends block normally
+            self.socket = socket.create_connection((self.host, self.port), timeout=self.CONNECT_TIMEOUT)
+            self.socket.settimeout(None)
+            # Writes are already coalesced, so Nagle would only delay the
+            # short tail of each utterance
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SEND_BUFFER_BYTES)
+            self._retry_delay = 0.1
             print("TCPPlayer: Connected.")
             return True
         except Exception as e:
@@ -102,29 +284,85 @@ class TCPPlayer:
             self.socket = None
             return False
 
-    def play_chunk(self, audio_data, volume=100):
-        if self.socket is None:
-            if not self.connect_socket():
-                time.sleep(0.1)
-                return
+    def upsample_2x(self, audio_data, gain=1.0):
+        """Polyphase 2x upsample, scaled by gain, into the reusable scratch buffer."""
+        n = len(audio_data)
+        self._up = grow_buffer(self._up, 2 * n)
+        out = self._up[:2 * n]
+        if n == 0:
+            return out
+        np.multiply(audio_data, gain, out=out[0::2], dtype=np.float32)
+        taps = HALFBAND_ODD_TAPS * np.float32(gain)
+        out[1::2] = np.convolve(audio_data, taps)[HALFBAND_HALF_LEN:HALFBAND_HALF_LEN + n]
+        return out
+
+    def scale(self, audio_data, gain):
+        """Scale by gain into the reusable scratch buffer (no-resample path)."""
+        n = len(audio_data)
+        self._up = grow_buffer(self._up, n)
+        out = self._up[:n]
+        np.multiply(audio_data, gain, out=out, dtype=np.float32)
+        return out
+
+    def to_int16(self, scaled):
+        """Clip already-scaled scratch samples in place and quantize to Int16."""
+        n = len(scaled)
+        self._i16 = grow_buffer(self._i16, n)
+        out = self._i16[:n]
+        np.clip(scaled, -32767, 32767, out=scaled)
+        np.copyto(out, scaled, casting='unsafe')
+        return out
+
+    def encode_chunk(self, audio_data, volume=100):
+        """Resample and quantize a chunk; returns an Int16 view of the scratch buffer."""
+        # Volume and the Int16 full-scale factor are a single gain applied in the
+        # first pass over the data; clipping to +/-32767 afterwards is the same
+        # as clipping to +/-1.0 before scaling.
+        gain = np.float32(volume / 100.0 * 32767)
 
         # Resample 24k -> 48k
         if self.target_rate == 48000 and self.sample_rate == 24000:
-            x = np.arange(len(audio_data))
-            x_new = np.arange(0, len(audio_data), 0.5)
-            audio_data = np.interp(x_new, x, audio_data)
-
-        # Apply volume
-        audio_data = audio_data * (volume / 100.0)
+            scaled = self.upsample_2x(audio_data, gain)
+        else:
+            scaled = self.scale(audio_data, gain)
 
-        # Clip
-        audio_data = np.clip(audio_data, -1.0, 1.0)
+        # Clip and convert to Int16
+        return self.to_int16(scaled)
 
-        # Convert to Int16
-        audio_int16 = (audio_data * 32767).astype(np.int16)
+    def play_chunk(self, audio_data, volume=100):
+        """Encode a chunk and send it, coalescing small chunks into WRITE_BATCH_BYTES writes."""
+        pcm = memoryview(self.encode_chunk(audio_data, volume)).cast('B')
+        if not self._pending and len(pcm) >= WRITE_BATCH_BYTES:
+            # Sentence-sized chunks usually exceed the batch size on their
+            # own; send them straight from the scratch buffer, no copy
+            self.write_bytes(pcm)
+            return
+        self._pending += pcm
+        if len(self._pending) >= WRITE_BATCH_BYTES:
+            self.flush()
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    def flush(self):
+        """Send any coalesced PCM (end of utterance or idle queue)."""
+        if self._pending:
+            self.write_bytes(self._pending)
+            self._pending.clear()
+
+    def discard_pending(self):
+        self._pending.clear()
+
+    def write_bytes(self, buf):
+        """Send already-encoded PCM bytes to the audio proxy."""
+        if self.socket is None:
+            if not self.connect_socket():
+                time.sleep(self._retry_delay)
+                self._retry_delay = min(self._retry_delay * 2, self.MAX_RETRY_DELAY)
+                return
 
         try:
-            self.socket.sendall(audio_int16.tobytes())
+            self.socket.sendall(buf)
         except (BrokenPipeError, ConnectionResetError, OSError) as e:
             print(f"TCPPlayer: Connection lost ({e}). Reconnecting...")
             self.connect_socket()
@@ -135,11 +373,30 @@ class TCPPlayer:
 class QueueHandler(FileSystemEventHandler):
     def on_created(self, event):
         if not event.is_directory:
-            fs_event.set()
+            self.enqueue(event.src_path)
 
     def on_moved(self, event):
         if not event.is_directory:
-            fs_event.set()
+            self.cancel(event.src_path)
+            self.enqueue(event.dest_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.cancel(event.src_path)
+
+    def cancel(self, path):
+        token = cancel_tokens.get(path)
+        if token is not None:
+            token.set()
+
+    def enqueue(self, path):
+        # Moves out of TODO (e.g. into WORKING) are reported here too; ignore them
+        if os.path.dirname(path) == TODO_DIR:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                return
+            fs_queue.put((mtime, path))
 
 def get_device():
     """Detect and return the best available device for inference."""
@@ -161,45 +418,180 @@ def get_device():
         print("No GPU available, falling back to CPU")
         return 'cpu'
 
+def get_inference_dtype(device):
+    """Return the autocast dtype selected by KOKORO_PRECISION, or None for full fp32."""
+    if device not in ('cuda', 'mps') or PRECISION == 'fp32':
+        return None
+    if PRECISION not in ('fp16', 'bf16', 'auto'):
+        print(f"Unknown KOKORO_PRECISION={PRECISION!r}, using fp32")
+        return None
+
+    if device == 'mps':
+        dtype = torch.float16
+    elif PRECISION == 'bf16' or (PRECISION == 'auto' and torch.cuda.is_bf16_supported()):
+        dtype = torch.bfloat16
+    else:
+        dtype = torch.float16
+
+    # Older PyTorch builds only support CUDA/CPU autocast
+    try:
+        torch.autocast(device_type=device, dtype=dtype)
+    except RuntimeError as e:
+        print(f"Autocast unavailable on {device} ({e}), using fp32")
+        return None
+    return dtype
+
+@contextlib.contextmanager
+def inference_context():
+    """Inference-mode (and, if enabled, autocast) context for model calls."""
+    with torch.inference_mode():
+        if inference_dtype is None:
+            yield
+        else:
+            with torch.autocast(device_type=inference_device, dtype=inference_dtype):
+                yield
+
 def initialize_pipeline():
-    global pipeline
+    global pipeline, inference_device, inference_dtype
     print("Initializing Kokoro Pipeline...")
 
     device = get_device()
     print(f"Using device: {device}")
 
-    # Initialize pipeline
-    pipeline = KPipeline(lang_code=LANG_CODE)
+    # Optional cap on intra-op threads so inference leaves headroom for the
+    # player, stdin reader and Node server sharing the container
+    num_threads = os.getenv('TORCH_NUM_THREADS')
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+        print(f"Torch intra-op threads: {torch.get_num_threads()}")
+
+    # Build the model directly on the target device rather than on KPipeline's
+    # default device and moving it afterwards
+    try:
+        pipeline = KPipeline(lang_code=LANG_CODE, device=device)
+    except Exception as e:
+        print(f"Warning: Failed to initialize pipeline on {device}: {e}")
+        print("Falling back to CPU")
+        pipeline = KPipeline(lang_code=LANG_CODE, device='cpu')
 
-    # Move model to GPU if available
+    # Read the device back to report where the model actually landed
+    device = pipeline.model.device.type
+    print(f"Model loaded on {device}")
     if device == 'cuda':
-        try:
-            pipeline.model = pipeline.model.cuda()
-            print("Model successfully moved to CUDA")
-            # Print GPU memory info
-            if torch.cuda.is_available():
-                print(f"GPU Memory Allocated: {torch.cuda.memory_allocated(0) / 1024**2:.2f} MB")
-                print(f"GPU Memory Reserved: {torch.cuda.memory_reserved(0) / 1024**2:.2f} MB")
-        except Exception as e:
-            print(f"Warning: Failed to move model to CUDA: {e}")
-            print("Falling back to CPU")
-    elif device == 'mps':
-        try:
-            pipeline.model = pipeline.model.to(torch.device('mps'))
-            print("Model successfully moved to MPS")
-        except Exception as e:
-            print(f"Warning: Failed to move model to MPS: {e}")
-            print("Falling back to CPU")
+        print(f"GPU Memory Allocated: {torch.cuda.memory_allocated(0) / 1024**2:.2f} MB")
+        print(f"GPU Memory Reserved: {torch.cuda.memory_reserved(0) / 1024**2:.2f} MB")
+
+    inference_device = device
+    inference_dtype = get_inference_dtype(device)
+    if inference_dtype is not None:
+        print(f"Using {inference_dtype} autocast for inference")
+
+    if TORCH_COMPILE:
+        compile_model()
+
+    warm_up_pipeline()
 
     print("Kokoro Pipeline Initialized.")
 
+def compile_model():
+    """Wrap the model's token forward pass in torch.compile (PyTorch 2.x only)."""
+    if not hasattr(torch, 'compile'):
+        print(f"TORCH_COMPILE ignored: torch {torch.__version__} has no torch.compile")
+        return
+    try:
+        model = pipeline.model
+        model.forward_with_tokens = torch.compile(model.forward_with_tokens, dynamic=True)
+        print("Model forward wrapped with torch.compile")
+    except Exception as e:
+        print(f"Warning: torch.compile failed, running eagerly: {e}")
+
+def warm_up_pipeline():
+    """Load every voice pack onto the model's device and run one short synthesis at startup."""
+    global inference_dtype
+    device = pipeline.model.device
+    for voice in sorted(VALID_VOICES):
+        try:
+            pipeline.voices[voice] = pipeline.load_voice(voice).to(device)
+        except Exception as e:
+            print(f"Warning: Failed to preload voice {voice}: {e}")
+
+    error = warm_up_synthesis()
+    if error is not None and 'forward_with_tokens' in vars(pipeline.model):
+        # torch.compile is lazy, so backend failures only surface on the first call
+        print(f"Warning: torch.compile failed ({error}), running eagerly")
+        del pipeline.model.forward_with_tokens
+        error = warm_up_synthesis()
+    if error is not None and inference_dtype is not None:
+        # Reduced precision is opt-in; drop back to fp32 if fp32 works where it didn't
+        dtype = inference_dtype
+        inference_dtype = None
+        fp32_error = warm_up_synthesis()
+        if fp32_error is None:
+            print(f"Warning: {dtype} inference failed ({error}), falling back to fp32")
+            error = None
+        else:
+            # Fails either way, so precision is not the cause; keep the requested dtype
+            inference_dtype = dtype
+            error = fp32_error
+    if error is not None:
+        print(f"Warning: Warm-up synthesis failed: {error}")
+    print(f"Preloaded {len(pipeline.voices)} voices")
+
+def warm_up_synthesis():
+    """Synthesize a short phrase; returns the error (including NaN/inf audio), or None."""
+    try:
+        with inference_context():
+            for result in pipeline("Ready.", voice=DEFAULT_VOICE):
+                if not np.isfinite(to_numpy(result.audio)).all():
+                    raise FloatingPointError("non-finite audio")
+    except Exception as e:
+        return e
+    return None
+
+def to_numpy(audio):
+    """Convert a Kokoro output tensor to a NumPy array (one device->host copy at most)."""
+    if hasattr(audio, 'detach'):
+        # Reduced-precision output has to be upcast before NumPy can take it
+        return audio.detach().cpu().float().numpy()
+    return audio
+
+def synthesize(pieces, voice, speed):
+    """Yield (index, result) per sentence in pieces, with G2P prefetched on g2p_executor."""
+    sentences = iter(enumerate(pieces))
+    pending = collections.deque()
+
+    def prefetch():
+        item = next(sentences, None)
+        if item is None:
+            return
+        index, (text, _) = item
+        pending.append((index, g2p_executor.submit(pipeline.g2p, text)))
+
+    for _ in range(G2P_PREFETCH):
+        prefetch()
+    try:
+        while pending:
+            index, future = pending.popleft()
+            prefetch()
+            # A failing sentence is skipped rather than ending the whole run
+            try:
+                _, tokens = future.result()
+                for result in pipeline.generate_from_tokens(tokens, voice=voice, speed=speed):
+                    yield index, result
+            except Exception as e:
+                print(f"Generator: Error in sentence {index}: {e}")
+    finally:
+        # Generation stopped early (skip/stop/cancel): drop queued lookups
+        for _, future in pending:
+            future.cancel()
+
 def parse_segments(text):
-    parts = re.split(r'(\{[a-zA-Z]+:[^}]+\})', text)
+    parts = SEGMENT_SPLIT_RE.split(text)
     segments = []
     for part in parts:
         if not part:
             continue
-        match = re.match(r'\{([a-zA-Z]+):([^}]+)\}', part)
+        match = SEGMENT_COMMAND_RE.match(part)
         if match:
             key = match.group(1).lower()
             value = match.group(2).strip()
@@ -208,15 +600,84 @@ def parse_segments(text):
             segments.append({'type': 'text', 'content': part})
     return segments
 
-def get_oldest_file(directory):
+def group_segments(segments):
+    """Fold parsed segments into (voice, speed, pieces) runs, one synthesize() call each."""
+    groups = []
+    voice = DEFAULT_VOICE
+    speed = 1.0
+    volume = 100
+
+    for seg in segments:
+        if seg['type'] == 'command':
+            k = seg['key']
+            v = seg['value']
+            if k == 'voice' and v in VALID_VOICES:
+                voice = v
+            elif k == 'speed':
+                try:
+                    speed = float(v)
+                except ValueError:
+                    pass
+            elif k == 'volume':
+                try:
+                    volume = int(v)
+                except ValueError:
+                    pass
+            continue
+
+        pieces = [(p, volume) for p in SENTENCE_SPLIT_RE.split(seg['content'].strip()) if p.strip()]
+        if not pieces:
+            continue
+        if groups and groups[-1][0] == voice and groups[-1][1] == speed:
+            groups[-1][2].extend(pieces)
+        else:
+            groups.append((voice, speed, pieces))
+
+    return groups
+
+def list_files_by_mtime(directory):
+    """Return the regular files in directory, oldest first."""
+    # scandir entries cache is_file() and stat(), so this is one stat per file
+    entries = []
     try:
-        files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
-        if not files:
-            return None
-        files.sort(key=lambda x: os.path.getmtime(os.path.join(directory, x)))
-        return files[0]
-    except Exception:
-        return None
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        entries.append((entry.stat().st_mtime, entry.name))
+                except OSError:
+                    continue
+    except OSError:
+        return []
+    entries.sort()
+    return [name for _, name in entries]
+
+def scan_todo(handler):
+    """Queue every file currently in TODO through the watcher's handler."""
+    for f in list_files_by_mtime(TODO_DIR):
+        handler.enqueue(os.path.join(TODO_DIR, f))
+
+def enqueue_todo_file(path):
+    """Move a file from TODO to WORKING and queue it for generation."""
+    filename = os.path.basename(path)
+    dst = os.path.join(WORKING_DIR, filename)
+    try:
+        shutil.move(path, dst)
+    except FileNotFoundError:
+        # Already claimed (startup scan and watcher can both see a file)
+        return
+    except Exception as e:
+        print(f"Error moving file: {e}")
+        return
+    print(f"Orchestrator: Moved {filename} to WORKING")
+    task_queue.put(dst)
+
+def emit(msg):
+    """Write one JSON message line to stdout for the host."""
+    # A single write, unlike print(), which writes the newline separately and
+    # lets a log line from another thread land in the middle of the message
+    sys.stdout.write(json.dumps(msg) + "\n")
+    sys.stdout.flush()
 
 def emit_status(state, text="", extra=None):
     msg = {"type": "status", "state": state}
@@ -224,20 +685,18 @@ def emit_status(state, text="", extra=None):
         msg["text"] = text
     if extra:
         msg.update(extra)
-    print(json.dumps(msg), flush=True)
+    emit(msg)
 
 def emit_progress(job_id, percent, phase="generating", detail=""):
-    msg = {"type": "progress", "jobId": job_id, "percent": percent, "phase": phase, "detail": detail}
-    print(json.dumps(msg), flush=True)
+    emit({"type": "progress", "jobId": job_id, "percent": percent, "phase": phase, "detail": detail})
 
 def emit_mp3_complete(job_id):
-    msg = {"type": "mp3_complete", "jobId": job_id}
-    print(json.dumps(msg), flush=True)
+    emit({"type": "mp3_complete", "jobId": job_id})
 
 def check_paused():
     """Block if playback is paused. Returns False if stopped."""
-    while playback_state['paused'] and not playback_state['stopped']:
-        pause_event.wait(timeout=0.2)
+    # 'resume' and 'stop' both set pause_event, so no polling is needed
+    pause_event.wait()
     return not playback_state['stopped']
 
 def generator_worker():
@@ -253,11 +712,12 @@ def generator_worker():
             # Determine if task is file path or memory object
             is_file = isinstance(task, str)
             source_id = task if is_file else "memory_task"
+            cancel = None
             text = ""
             mp3_mode = False
             mp3_path = None
             mp3_announce = False
-            accumulated_audio = []
+            mp3_encoder = None
 
             if is_file:
                 file_path = task
@@ -268,8 +728,9 @@ def generator_worker():
 
                 print(f"Generator: Processing file {file_path}")
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        text = f.read().strip()
+                    # Unbuffered binary read: FileIO.readall sizes its buffer from fstat
+                    with open(file_path, 'rb', buffering=0) as f:
+                        text = f.readall().decode('utf-8').strip()
                 except Exception as e:
                     print(f"Generator: Error reading file: {e}")
                     task_queue.task_done()
@@ -296,45 +757,25 @@ def generator_worker():
                 text = prefix + text
 
             if not text:
-                mp3_info = {'path': mp3_path, 'audio': accumulated_audio, 'announce': mp3_announce} if mp3_mode else None
+                mp3_info = {'path': mp3_path, 'encoder': mp3_encoder, 'announce': mp3_announce} if mp3_mode else None
                 audio_queue.put(AudioChunk(None, 0, 0, source_id, is_end_of_file=True, mp3_info=mp3_info))
                 task_queue.task_done()
                 continue
 
-            current_voice = DEFAULT_VOICE
-            current_speed = 1.0
-            current_volume = 100
-
-            segments = parse_segments(text)
-            split_pattern = r'(?<=[\.\?\!])\s+|\n+'
+            if is_file:
+                # Created only once the task will actually generate, so the
+                # early exits above leave nothing behind in cancel_tokens
+                cancel = get_cancel_token(file_path)
 
-            for seg in segments:
-                if is_file and not os.path.exists(file_path):
+            for voice, speed, pieces in group_segments(parse_segments(text)):
+                if is_file and cancel.is_set():
                     print(f"Generator: File {file_path} removed. Stopping generation.")
                     break
 
-                if seg['type'] == 'command':
-                    k = seg['key']
-                    v = seg['value']
-                    if k == 'voice' and v in VALID_VOICES:
-                        current_voice = v
-                    elif k == 'speed':
-                        try:
-                            current_speed = float(v)
-                        except: pass
-                    elif k == 'volume':
-                        try:
-                            current_volume = int(v)
-                        except: pass
-
-                elif seg['type'] == 'text':
-                    content = seg['content'].strip()
-                    if not content: continue
-
-                    try:
-                        generator = pipeline(content, voice=current_voice, speed=current_speed, split_pattern=split_pattern)
-                        for i, (gs, ps, audio) in enumerate(generator):
-                            if is_file and not os.path.exists(file_path):
+                try:
+                    with inference_context():
+                        for index, result in synthesize(pieces, voice, speed):
+                            if is_file and cancel.is_set():
                                 break
                             # Check playback controls
                             if playback_state['stopped'] or playback_state['skip_current']:
@@ -342,40 +783,37 @@ def generator_worker():
                             if not check_paused():
                                 break
 
-                            # Convert Tensor to Numpy if needed
-                            if hasattr(audio, 'numpy'):
-                                audio = audio.numpy()
+                            volume = pieces[index][1]
+                            audio = to_numpy(result.audio)
 
                             if mp3_mode:
-                                # Accumulate audio for MP3 file
-                                accumulated_audio.append(audio)
+                                # Stream audio straight into the MP3 encoder
+                                if mp3_encoder is None:
+                                    mp3_encoder = MP3Encoder(mp3_path)
+                                mp3_encoder.write(audio)
                             else:
                                 # Send to player for immediate playback
-                                audio_queue.put(AudioChunk(audio, 24000, current_volume, source_id))
-                    except Exception as e:
-                        print(f"Generator: Error in pipeline: {e}")
+                                audio_queue.put(AudioChunk(audio, 24000, volume, source_id, cancel=cancel))
+                except Exception as e:
+                    print(f"Generator: Error in pipeline: {e}")
 
-            if is_file and os.path.exists(file_path):
+            if is_file and not cancel.is_set():
                 job_id = None  # file tasks don't have jobId
-                mp3_info = {'path': mp3_path, 'audio': accumulated_audio, 'announce': mp3_announce} if mp3_mode else None
-                audio_queue.put(AudioChunk(None, 0, 0, source_id, is_end_of_file=True, mp3_info=mp3_info))
-            elif not is_file:
+                mp3_info = {'path': mp3_path, 'encoder': mp3_encoder, 'announce': mp3_announce} if mp3_mode else None
+                audio_queue.put(AudioChunk(None, 0, 0, source_id, is_end_of_file=True, mp3_info=mp3_info, cancel=cancel))
+            elif is_file:
+                cancel_tokens.pop(file_path, None)
+            else:
                 job_id = task.get('jobId') if not is_file else None
-                mp3_info = {'path': mp3_path, 'audio': accumulated_audio, 'announce': mp3_announce, 'jobId': job_id} if mp3_mode else None
+                mp3_info = {'path': mp3_path, 'encoder': mp3_encoder, 'announce': mp3_announce, 'jobId': job_id} if mp3_mode else None
                 audio_queue.put(AudioChunk(None, 0, 0, source_id, is_end_of_file=True, mp3_info=mp3_info))
 
             # Track completed task for previous/next navigation
             completed_tasks.append(task)
-            if len(completed_tasks) > 100:
-                completed_tasks.pop(0)
 
             task_queue.task_done()
             print(f"Generator: Finished generating {source_id}")
 
-            # Clean up GPU memory if using CUDA
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-
         except Exception as e:
             print(f"Generator: Critical Error: {e}")
             time.sleep(1)
@@ -385,86 +823,76 @@ def player_worker():
 
     while True:
         try:
-            chunk = audio_queue.get()
+            try:
+                chunk = audio_queue.get(timeout=WRITE_FLUSH_TIMEOUT if player.has_pending() else None)
+            except queue.Empty:
+                player.flush()
+                continue
 
-            # Check if source file still exists (only for file tasks)
+            # Drop chunks of file tasks whose source left WORKING
             is_file = isinstance(chunk.source_id, str) and chunk.source_id.startswith("/")
 
-            if is_file and not os.path.exists(chunk.source_id):
+            if chunk.cancel is not None and chunk.cancel.is_set():
                 print(f"Player: File {chunk.source_id} removed. Discarding chunk.")
-                audio_queue.task_done()
+                if chunk.is_end_of_file:
+                    cancel_tokens.pop(chunk.source_id, None)
+                    if chunk.mp3_info and chunk.mp3_info.get('encoder'):
+                        chunk.mp3_info['encoder'].abort()
+                player.discard_pending()
                 continue
 
             if chunk.is_end_of_file:
-                # Handle MP3 file creation
-                if chunk.mp3_info and chunk.mp3_info.get('path') and chunk.mp3_info.get('audio'):
-                    mp3_path = chunk.mp3_info['path']
-                    audio_list = chunk.mp3_info['audio']
+                player.flush()
+
+                # Finish MP3 file creation
+                if chunk.mp3_info and chunk.mp3_info.get('encoder'):
+                    encoder = chunk.mp3_info['encoder']
+                    mp3_path = encoder.path
                     job_id = chunk.mp3_info.get('jobId')
 
                     try:
-                        # Ensure output directory exists
-                        os.makedirs(os.path.dirname(mp3_path), exist_ok=True)
-
-                        # Concatenate all audio chunks
-                        full_audio = np.concatenate(audio_list)
-
-                        # Save as WAV first, then convert to MP3
-                        wav_path = mp3_path.replace('.mp3', '.wav') if mp3_path.endswith('.mp3') else mp3_path + '.wav'
-                        sf.write(wav_path, full_audio, 24000)
-
-                        # Convert WAV to MP3 using ffmpeg
-                        try:
-                            subprocess.run(['ffmpeg', '-y', '-i', wav_path, '-codec:a', 'libmp3lame', '-qscale:a', '2', mp3_path],
-                                         check=True, capture_output=True)
-                            os.remove(wav_path)  # Clean up WAV file
-                            print(f"Player: MP3 file created at {mp3_path}")
-
-                            # Signal MP3 completion for combine jobs
-                            if job_id:
-                                emit_mp3_complete(job_id)
-
-                            # Announce file creation to speaker (only if mp3announce is True)
-                            if chunk.mp3_info.get('announce', False):
-                                announcement = f"MP3 file created at {os.path.basename(mp3_path)}"
-                                announcement_task = {'text': announcement, 'voice': DEFAULT_VOICE, 'speed': 1.0, 'mp3': False}
-                                task_queue.put(announcement_task)
-
-                        except subprocess.CalledProcessError as e:
-                            print(f"Player: Error converting to MP3: {e.stderr.decode()}")
-                            # Fall back to WAV if MP3 conversion fails
-                            print(f"Player: WAV file saved at {wav_path}")
+                        encoder.close()
+                        print(f"Player: MP3 file created at {mp3_path}")
+
+                        # Signal MP3 completion for combine jobs
+                        if job_id:
+                            emit_mp3_complete(job_id)
+
+                        # Announce file creation to speaker (only if mp3announce is True)
+                        if chunk.mp3_info.get('announce', False):
+                            announcement = f"MP3 file created at {os.path.basename(mp3_path)}"
+                            announcement_task = {'text': announcement, 'voice': DEFAULT_VOICE, 'speed': 1.0, 'mp3': False}
+                            task_queue.put(announcement_task)
                     except Exception as e:
                         print(f"Player: Error creating MP3 file: {e}")
 
                 if is_file:
+                    cancel_tokens.pop(chunk.source_id, None)
                     filename = os.path.basename(chunk.source_id)
                     done_path = os.path.join(DONE_DIR, filename)
                     try:
-                        if os.path.exists(chunk.source_id):
-                            shutil.move(chunk.source_id, done_path)
-                            print(f"Player: Finished {filename} (Moved to DONE)")
+                        shutil.move(chunk.source_id, done_path)
+                        print(f"Player: Finished {filename} (Moved to DONE)")
+                    except FileNotFoundError:
+                        pass  # Removed externally after generation finished
                     except Exception as e:
                         print(f"Player: Error moving file: {e}")
                 else:
                     print("Player: Finished memory task")
 
-                audio_queue.task_done()
                 continue
 
             # Play Audio via Stream
             if chunk.audio_data is not None:
                 # Check playback controls before playing
                 if playback_state['stopped'] or playback_state['skip_current']:
-                    audio_queue.task_done()
+                    player.discard_pending()
                     continue
                 if not check_paused():
-                    audio_queue.task_done()
+                    player.discard_pending()
                     continue
                 player.play_chunk(chunk.audio_data, chunk.volume)
 
-            audio_queue.task_done()
-
         except Exception as e:
             print(f"Player: Critical Error: {e}")
             time.sleep(1)
@@ -523,8 +951,12 @@ def handle_control(data):
                 break
         while not audio_queue.empty():
             try:
-                audio_queue.get_nowait()
-                audio_queue.task_done()
+                chunk = audio_queue.get_nowait()
+                if chunk.mp3_info and chunk.mp3_info.get('encoder'):
+                    chunk.mp3_info['encoder'].abort()
+                # Drained chunks never reach the player, which otherwise drops the token
+                if chunk.cancel is not None:
+                    cancel_tokens.pop(chunk.source_id, None)
             except queue.Empty:
                 break
         print("Control: Playback stopped, queues cleared")
@@ -558,18 +990,13 @@ def handle_combine_mp3(data):
     print(f"Combine: Merging {len(part_paths)} parts into {output_path}")
 
     try:
-        # Create ffmpeg concat list file
-        concat_list_path = output_path.replace('.mp3', '_concat.txt')
-        with open(concat_list_path, 'w') as f:
+        # CBR MP3 is a plain frame stream, so parts concatenate byte-wise;
+        # only a leading ID3v2 tag has to be skipped on each part
+        with open(output_path, 'wb') as out:
             for p in part_paths:
-                f.write(f"file '{p}'\n")
-
-        # Combine using ffmpeg concat demuxer
-        subprocess.run(
-            ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', concat_list_path, '-codec:a', 'copy', output_path],
-            check=True, capture_output=True
-        )
-        os.remove(concat_list_path)
+                with open(p, 'rb') as part:
+                    part.seek(id3v2_size(part.read(10)))
+                    shutil.copyfileobj(part, out)
 
         # Clean up part files if requested
         if cleanup:
@@ -580,17 +1007,20 @@ def handle_combine_mp3(data):
         print(f"Combine: Successfully created {output_path}")
 
         # Emit completion
-        result = {"type": "status", "state": "combine_complete", "jobId": job_id, "outputPath": output_path}
-        print(json.dumps(result), flush=True)
+        emit({"type": "status", "state": "combine_complete", "jobId": job_id, "outputPath": output_path})
 
-    except subprocess.CalledProcessError as e:
-        print(f"Combine: ffmpeg error: {e.stderr.decode()}")
-        error_msg = {"type": "error", "message": f"MP3 combine failed: {e.stderr.decode()}", "jobId": job_id}
-        print(json.dumps(error_msg), flush=True)
     except Exception as e:
         print(f"Combine: Error: {e}")
-        error_msg = {"type": "error", "message": f"MP3 combine failed: {str(e)}", "jobId": job_id}
-        print(json.dumps(error_msg), flush=True)
+        emit({"type": "error", "message": f"MP3 combine failed: {str(e)}", "jobId": job_id})
+
+def id3v2_size(header):
+    """Length of an ID3v2 tag given the first 10 bytes of a file (0 if untagged)."""
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    size = 10 + ((header[6] & 0x7f) << 21 | (header[7] & 0x7f) << 14 | (header[8] & 0x7f) << 7 | (header[9] & 0x7f))
+    if header[5] & 0x10:
+        size += 10  # footer present
+    return size
 
 def main():
     print("Starting TTS Kokoro Processor (Hybrid Mode)...")
@@ -606,37 +1036,32 @@ def main():
     threading.Thread(target=player_worker, daemon=True).start()
     threading.Thread(target=stdin_reader, daemon=True).start()
 
+    # Recover files
+    for f in list_files_by_mtime(WORKING_DIR):
+        print(f"Recovering file from WORKING: {f}")
+        task_queue.put(os.path.join(WORKING_DIR, f))
+
     event_handler = QueueHandler()
     observer = Observer()
     observer.schedule(event_handler, TODO_DIR, recursive=False)
+    observer.schedule(event_handler, WORKING_DIR, recursive=False)
     observer.start()
     print(f"Monitoring {TODO_DIR} and Stdin...")
 
-    # Recover files
-    for f in sorted(os.listdir(WORKING_DIR), key=lambda x: os.path.getmtime(os.path.join(WORKING_DIR, x))):
-        path = os.path.join(WORKING_DIR, f)
-        if os.path.isfile(path):
-            print(f"Recovering file from WORKING: {f}")
-            task_queue.put(path)
+    # Files dropped into TODO while the processor was down produce no events
+    scan_todo(event_handler)
 
     try:
         while True:
-            todo_file = get_oldest_file(TODO_DIR)
-            if todo_file:
-                src = os.path.join(TODO_DIR, todo_file)
-                dst = os.path.join(WORKING_DIR, todo_file)
-                try:
-                    print(f"Orchestrator: Moving {todo_file} to WORKING")
-                    shutil.move(src, dst)
-                    task_queue.put(dst)
-                    continue
-                except Exception as e:
-                    print(f"Error moving file: {e}")
-                    time.sleep(1)
-
-            fs_event.wait(timeout=1.0)
-            fs_event.clear()
-
+            try:
+                _, path = fs_queue.get(timeout=TODO_RESCAN_INTERVAL)
+            except queue.Empty:
+                # Events are only the fast path: host-side writes on bind mounts
+                # (Docker Desktop) and inotify overflows can go unreported, and
+                # failed moves are retried here too
+                scan_todo(event_handler)
+                continue
+            enqueue_todo_file(path)
     except KeyboardInterrupt:
         print("Stopping...")
         observer.stop()